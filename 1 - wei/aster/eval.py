@@ -136,7 +136,9 @@ def main(unused_argv):
 
   evaluator.evaluate(create_input_dict_fn, model_fn, eval_config,
                      checkpoint_dir, eval_dir,
-                     repeat_evaluation=FLAGS.repeat)
+                     repeat_evaluation=FLAGS.repeat,
+                     deterministic_input=(not input_config.shuffle and
+                                          input_config.num_readers == 1))
 
 if __name__ == '__main__':
   tf.app.run()
@@ -18,9 +18,12 @@
 import copy
 import logging
 import os
+import pickle
+import string
 import time
 
 import numpy as np
+import PIL.Image as Image
 import tensorflow as tf
 import matplotlib
 matplotlib.use('Agg')
@@ -29,6 +32,14 @@ import matplotlib.pyplot as plt
 from aster.utils import recognition_evaluation
 from aster.utils import visualization_utils as vis_utils
 
+# Number of batches between two saves of the evaluation progress.
+_EVAL_CHECKPOINT_INTERVAL = 100
+
+# ASCII characters removed by `_normalize_text`.
+_NON_ALPHANUMERIC_ASCII = bytes(bytearray(
+    c for c in range(128)
+    if chr(c) not in string.digits + string.ascii_letters))
+
 
 def write_metrics(metrics, global_step, summary_dir):
   """Write metrics to a summary directory.
@@ -40,17 +51,38 @@ def write_metrics(metrics, global_step, summary_dir):
   """
   logging.info('Writing metrics to tf summary.')
   summary_writer = tf.summary.FileWriter(summary_dir)
+  summary = tf.Summary(value=[
+      tf.Summary.Value(tag=key, simple_value=metrics[key])
+      for key in sorted(metrics)
+  ])
+  summary_writer.add_summary(summary, global_step)
+  summary_writer.close()
   for key in sorted(metrics):
-    summary = tf.Summary(value=[
-        tf.Summary.Value(tag=key, simple_value=metrics[key]),
-    ])
-    summary_writer.add_summary(summary, global_step)
     logging.info('%s: %f', key, metrics[key])
-  summary_writer.close()
   logging.info('Metrics written to tf summary.')
 
 
-# TODO: Add tests.
+def _save_eval_checkpoint(checkpoint_path, state):
+  """Atomically pickles the progress of an evaluation to checkpoint_path."""
+  tmp_path = checkpoint_path + '.tmp'
+  with tf.gfile.GFile(tmp_path, 'wb') as f:
+    pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+  tf.gfile.Rename(tmp_path, checkpoint_path, overwrite=True)
+
+
+def _load_eval_checkpoint(checkpoint_path, global_step):
+  """Returns the saved evaluation progress for global_step, or None."""
+  if not tf.gfile.Exists(checkpoint_path):
+    return None
+  with tf.gfile.GFile(checkpoint_path, 'rb') as f:
+    state = pickle.load(f)
+  if state['global_step'] != global_step:
+    logging.info('Ignoring evaluation checkpoint of step %d, evaluating step %d',
+                 state['global_step'], global_step)
+    return None
+  return state
+
+
 # TODO: Have an argument called `aggregated_processor_tensor_keys` that contains
 # a whitelist of tensors used by the `aggregated_result_processor` instead of a
 # blacklist. This will prevent us from inadvertently adding any evaluated
@@ -69,7 +101,8 @@ def run_checkpoint_once(tensor_dict,
                         save_graph=False,
                         save_graph_dir='',
                         metric_names_to_values=None,
-                        keys_to_exclude_from_results=()):
+                        keys_to_exclude_from_results=(),
+                        resume_skip_tensor=None):
   """Evaluates both python metrics and tensorflow slim metrics.
 
   Python metrics are processed in batch by the aggregated_result_processor,
@@ -122,6 +155,17 @@ def run_checkpoint_once(tensor_dict,
     keys_to_exclude_from_results: keys in tensor_dict that will be excluded
       from results_list. Note that the tensors corresponding to these keys will
       still be evaluated for each batch, but won't be added to results_list.
+    resume_skip_tensor: None, or a tensor that dequeues one batch from the
+      input pipeline without running the model. If set, the progress of the
+      evaluation is saved to `summary_dir/_ckpt.pkl` every
+      `_EVAL_CHECKPOINT_INTERVAL` batches, and an interrupted evaluation of the
+      same global step resumes from there, running this tensor once per
+      completed batch to skip the inputs already evaluated. This requires the
+      input pipeline to produce examples in the same order on every run (e.g.
+      no shuffling and a single reader); otherwise the skipped inputs differ
+      from the evaluated ones and the resumed results are wrong. Tensorflow
+      metrics updated by `update_op` are not saved and only cover the resumed
+      batches.
 
   Raises:
     ValueError: if restore_fn is None and checkpoint_dirs doesn't have at least
@@ -149,13 +193,29 @@ def run_checkpoint_once(tensor_dict,
   if save_graph:
     tf.train.write_graph(sess.graph_def, save_graph_dir, 'eval.pbtxt')
 
-  valid_keys = list(set(tensor_dict.keys()) - set(keys_to_exclude_from_results))
+  global_step = tf.train.global_step(sess, tf.train.get_global_step())
+  valid_keys = (frozenset(tensor_dict.keys()) -
+                frozenset(keys_to_exclude_from_results))
   result_lists = {key: [] for key in valid_keys}
   counters = {'skipped': 0, 'success': 0}
+  start_batch = 0
+  checkpoint_path = os.path.join(summary_dir, '_ckpt.pkl')
+  resume_state = None
+  if resume_skip_tensor is not None:
+    resume_state = _load_eval_checkpoint(checkpoint_path, global_step)
+  if resume_state is not None:
+    start_batch = resume_state['batch']
+    counters = resume_state['counters']
+    result_lists = resume_state['result_lists']
+    logging.info('Resuming evaluation of step %d at batch %d',
+                 global_step, start_batch)
   other_metrics = None
+  completed = False
   with tf.contrib.slim.queues.QueueRunners(sess):
     try:
-      for batch in range(int(num_batches)):
+      for _ in range(start_batch):
+        sess.run(resume_skip_tensor)
+      for batch in range(start_batch, int(num_batches)):
         if (batch + 1) % 100 == 0:
           logging.info('Running eval ops batch %d/%d', batch + 1, num_batches)
         if not batch_processor:
@@ -169,25 +229,45 @@ def run_checkpoint_once(tensor_dict,
         else:
           result_dict = batch_processor(
               tensor_dict, sess, batch, counters, update_op)
-        for key in result_dict:
-          if key in valid_keys:
-            result_lists[key].append(result_dict[key])
+        for key in valid_keys.intersection(result_dict):
+          result_lists[key].append(result_dict[key])
+        if (resume_skip_tensor is not None and
+            (batch + 1) % _EVAL_CHECKPOINT_INTERVAL == 0):
+          _save_eval_checkpoint(checkpoint_path, {
+              'global_step': global_step,
+              'batch': batch + 1,
+              'counters': counters,
+              'result_lists': result_lists,
+          })
+      completed = True
       if metric_names_to_values is not None:
         other_metrics = sess.run(metric_names_to_values)
       logging.info('Running eval batches done.')
     except tf.errors.OutOfRangeError:
+      completed = True
       logging.info('Done evaluating -- epoch limit reached')
     finally:
       # When done, ask the threads to stop.
       metrics = aggregated_result_processor(result_lists)
+      if ((completed or resume_skip_tensor is None) and
+          tf.gfile.Exists(checkpoint_path)):
+        tf.gfile.Remove(checkpoint_path)
       if other_metrics is not None:
         metrics.update(other_metrics)
-      global_step = tf.train.global_step(sess, tf.train.get_global_step())
       write_metrics(metrics, global_step, summary_dir)
       logging.info('# success: %d', counters['success'])
       logging.info('# skipped: %d', counters['skipped'])
   sess.close()
 
+
+def _checkpoint_index_mtime(checkpoint_dir):
+  """Returns the mtime of the `checkpoint` index file, or None if unknown."""
+  try:
+    return os.stat(os.path.join(checkpoint_dir, 'checkpoint')).st_mtime
+  except OSError:
+    return None
+
+
 # TODO: Add tests.
 def repeated_checkpoint_run(tensor_dict,
                             update_op,
@@ -204,7 +284,8 @@ def repeated_checkpoint_run(tensor_dict,
                             save_graph=False,
                             save_graph_dir='',
                             metric_names_to_values=None,
-                            keys_to_exclude_from_results=()):
+                            keys_to_exclude_from_results=(),
+                            resume_skip_tensor=None):
   """Periodically evaluates desired tensors using checkpoint_dirs or restore_fn.
 
   This function repeatedly loads a checkpoint and evaluates a desired
@@ -257,6 +338,8 @@ def repeated_checkpoint_run(tensor_dict,
     keys_to_exclude_from_results: keys in tensor_dict that will be excluded
       from results_list. Note that the tensors corresponding to these keys will
       still be evaluated for each batch, but won't be added to results_list.
+    resume_skip_tensor: None, or a tensor used to resume an interrupted
+      evaluation. See `run_checkpoint_once`.
 
   Raises:
     ValueError: if max_num_of_evaluations is not None or a positive number.
@@ -270,12 +353,19 @@ def repeated_checkpoint_run(tensor_dict,
     raise ValueError('`checkpoint_dirs` must have at least one entry.')
 
   last_evaluated_model_path = None
+  # mtime of the checkpoint index file and the model path parsed from it.
+  last_checkpoint_state = (None, None)
   number_of_evaluations = 0
   while True:
     start = time.time()
     logging.info('Starting evaluation at ' + time.strftime('%Y-%m-%d-%H:%M:%S',
                                                            time.gmtime()))
-    model_path = tf.train.latest_checkpoint(checkpoint_dirs[0])
+    index_mtime = _checkpoint_index_mtime(checkpoint_dirs[0])
+    if index_mtime is not None and index_mtime == last_checkpoint_state[0]:
+      model_path = last_checkpoint_state[1]
+    else:
+      model_path = tf.train.latest_checkpoint(checkpoint_dirs[0])
+      last_checkpoint_state = (index_mtime, model_path)
     if not model_path:
       logging.info('No model found in %s. Will try again in %d seconds',
                    checkpoint_dirs[0], eval_interval_secs)
@@ -289,7 +379,7 @@ def repeated_checkpoint_run(tensor_dict,
                           batch_processor, checkpoint_dirs,
                           variables_to_restore, restore_fn, num_batches, master,
                           save_graph, save_graph_dir, metric_names_to_values,
-                          keys_to_exclude_from_results)
+                          keys_to_exclude_from_results, resume_skip_tensor)
     number_of_evaluations += 1
 
     if (max_number_of_evaluations and
@@ -308,84 +398,104 @@ def evaluate_recognition_results(result_lists):
       'filename']
   if not set(expected_keys).issubset(set(result_lists.keys())):
     raise ValueError('result_lists does not have expected key set.')
-  num_results = len(result_lists[expected_keys[0]])
-  for key in expected_keys:
-    if len(result_lists[key]) != num_results:
-      raise ValueError('Inconsistent list sizes in result_lists')
+  if len(set(len(result_lists[key]) for key in expected_keys)) != 1:
+    raise ValueError('Inconsistent list sizes in result_lists')
 
   evaluator = recognition_evaluation.RecognitionEvaluation()
-  for idx, image_id in enumerate(result_lists['filename']):
-    evaluator.add_single_image_recognition_info(
-        image_id,
-        result_lists['recognition_text'][idx],
-        result_lists['groundtruth_text'][idx])
+  evaluator.add_multiple_images_recognition_info(
+      result_lists['filename'],
+      result_lists['recognition_text'],
+      result_lists['groundtruth_text'])
   return evaluator.evaluate_all()
 
 
-def visualize_recognition_results(result_dict, tag, global_step,
-                                  summary_dir=None,
-                                  export_dir=None,
-                                  summary_writer=None,
-                                  only_visualize_incorrect=False):
-  import string
-  from scipy.misc import imresize
-
-  # vis_utils.draw_keypoints_on_image_array(image, control_points[:,::-1], radius=1)
-  # summary = tf.Summary(value=[
-  #     tf.Summary.Value(tag=tag, image=tf.Summary.Image(
-  #         encoded_image_string=vis_utils.encode_image_array_as_png_bytes(image)))])
-  # summary_writer.add_summary(summary, global_step)
-  # logging.info('Detection visualizations written to summary with tag %s.', tag)
-
-  # export visualization
-  fig = plt.figure(frameon=False)
-  ax = plt.Axes(fig, [0., 0., 1., 1.])
-  ax.set_axis_off()
-  fig.add_axes(ax)
-
-  image = result_dict['original_image']
-  image_h, image_w, _ = image.shape
-  image = imresize(image, (128. / image_w))
-
-  ax.imshow(image)
-  image_h, image_w, _ = image.shape
-  ax.imshow(image.astype(np.uint8))
-
-  if 'control_points' in result_dict:
-    control_points = result_dict['control_points'][0]
-    ax.scatter(control_points[:,0] * image_w, control_points[:,1] * image_h, marker='+', c='#42f4aa', s=100)
-
-  def _normalize_text(text):
-    text = ''.join(filter(lambda x: x in (string.digits + string.ascii_letters), text))
-    return text.lower()
-
-  gt_text = _normalize_text(result_dict['groundtruth_text'].decode('utf-8'))
-  rec_text = _normalize_text(result_dict['recognition_text'].decode('utf-8'))
-
-  if only_visualize_incorrect and gt_text == rec_text:
-    return
-
-  # plt.title(result_dict['groundtruth_text'].decode('utf-8'))
-
-  # plt.subplot(2,1,2)
-  
-  # plt.imshow(rectified_image)
-  # plt.title(result_dict['recognition_text'].decode('utf-8'))
-
-  if not os.path.exists(export_dir):
-    os.makedirs(export_dir)
-  save_path = os.path.join(export_dir, tag + '_original_{}_{}'.format(gt_text, rec_text) + '.pdf')
-  plt.savefig(save_path, bbox_inches='tight')
-  logging.info('Detailed visualization exported to {}'.format(save_path))
-
-  if 'rectified_images' in result_dict:
-    rectified_image = result_dict['rectified_images'][0]
-    rectified_image = (127.5 * (rectified_image + 1.0)).astype(np.uint8)
-    ax.clear()
-    ax.set_axis_off()
-    ax.imshow(rectified_image)
-    save_path = os.path.join(export_dir, tag + '_rectified' + '.pdf')
-    plt.savefig(save_path, bbox_inches='tight')
+def _normalize_text(text):
+  """Keeps the ASCII letters and digits of text, lowercased."""
+  text = text.encode('ascii', 'ignore').translate(None, _NON_ALPHANUMERIC_ASCII)
+  return text.decode('ascii').lower()
+
+
+class ResultVisualizer(object):
+  """Exports recognition results as images.
+
+  A single matplotlib figure is created on first use and reused for every
+  subsequent call, since building a figure per image dominates the cost of
+  visualizing many results.
+  """
+
+  def __init__(self, image_format='png'):
+    """Constructor.
+
+    Args:
+      image_format: file format of the exported visualizations, e.g. 'png' or
+        'pdf'.
+    """
+    self._image_format = image_format
+    self._fig = None
+    self._ax = None
+
+  def _reset_axes(self):
+    if self._fig is None:
+      self._fig = plt.figure(frameon=False)
+      self._ax = plt.Axes(self._fig, [0., 0., 1., 1.])
+      self._fig.add_axes(self._ax)
+    else:
+      self._ax.clear()
+    self._ax.set_axis_off()
+    return self._ax
+
+  def _save(self, export_dir, filename):
+    save_path = os.path.join(export_dir, filename + '.' + self._image_format)
+    self._fig.savefig(save_path, bbox_inches='tight')
     logging.info('Detailed visualization exported to {}'.format(save_path))
 
-  plt.close()
+  def visualize(self, result_dict, tag, global_step,
+                summary_dir=None,
+                export_dir=None,
+                summary_writer=None,
+                only_visualize_incorrect=False):
+    gt_text = _normalize_text(result_dict['groundtruth_text'].decode('utf-8'))
+    rec_text = _normalize_text(result_dict['recognition_text'].decode('utf-8'))
+
+    if only_visualize_incorrect and gt_text == rec_text:
+      return
+
+    # vis_utils.draw_keypoints_on_image_array(image, control_points[:,::-1], radius=1)
+    # summary = tf.Summary(value=[
+    #     tf.Summary.Value(tag=tag, image=tf.Summary.Image(
+    #         encoded_image_string=vis_utils.encode_image_array_as_png_bytes(image)))])
+    # summary_writer.add_summary(summary, global_step)
+    # logging.info('Detection visualizations written to summary with tag %s.', tag)
+
+    # export visualization
+    if not os.path.exists(export_dir):
+      os.makedirs(export_dir)
+
+    ax = self._reset_axes()
+    image = result_dict['original_image']
+    image_h, image_w, _ = image.shape
+    new_h = int(round(image_h * 128.0 / image_w))
+    image = np.asarray(Image.fromarray(image.astype(np.uint8)).resize(
+        (128, new_h), Image.BILINEAR))
+
+    image_h, image_w, _ = image.shape
+    ax.imshow(image)
+
+    if 'control_points' in result_dict:
+      control_points = result_dict['control_points'][0]
+      ax.scatter(control_points[:,0] * image_w, control_points[:,1] * image_h, marker='+', c='#42f4aa', s=100)
+
+    self._save(export_dir, tag + '_original_{}_{}'.format(gt_text, rec_text))
+
+    if 'rectified_images' in result_dict:
+      rectified_image = result_dict['rectified_images'][0]
+      rectified_image = (127.5 * (rectified_image + 1.0)).astype(np.uint8)
+      ax = self._reset_axes()
+      ax.imshow(rectified_image)
+      self._save(export_dir, tag + '_rectified')
+
+  def close(self):
+    if self._fig is not None:
+      plt.close(self._fig)
+      self._fig = None
+      self._ax = None
@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+import tensorflow as tf
+
+from aster import eval_util
+
+
+class EvalCheckpointTest(tf.test.TestCase):
+
+  def test_checkpoint_round_trip(self):
+    checkpoint_path = os.path.join(
+        tempfile.mkdtemp(dir=self.get_temp_dir()), '_ckpt.pkl')
+    state = {
+        'global_step': 7,
+        'batch': 100,
+        'counters': {'skipped': 1, 'success': 99},
+        'result_lists': {'filename': [b'a', b'b']},
+    }
+    eval_util._save_eval_checkpoint(checkpoint_path, state)
+    self.assertFalse(tf.gfile.Exists(checkpoint_path + '.tmp'))
+    self.assertEqual(eval_util._load_eval_checkpoint(checkpoint_path, 7), state)
+
+  def test_checkpoint_of_other_step_is_ignored(self):
+    checkpoint_path = os.path.join(
+        tempfile.mkdtemp(dir=self.get_temp_dir()), '_ckpt.pkl')
+    eval_util._save_eval_checkpoint(checkpoint_path, {'global_step': 7})
+    self.assertIsNone(eval_util._load_eval_checkpoint(checkpoint_path, 8))
+
+  def test_missing_checkpoint(self):
+    checkpoint_path = os.path.join(
+        tempfile.mkdtemp(dir=self.get_temp_dir()), '_ckpt.pkl')
+    self.assertIsNone(eval_util._load_eval_checkpoint(checkpoint_path, 0))
+
+
+class RunCheckpointOnceResumeTest(tf.test.TestCase):
+
+  def _run_checkpoint_once(self, summary_dir, num_batches, fail_at_batch=None):
+    evaluated_batches = []
+    metrics = {}
+
+    def _process_batch(tensor_dict, sess, batch_index, counters, update_op):
+      if batch_index == fail_at_batch:
+        raise RuntimeError('interrupted')
+      evaluated_batches.append(batch_index)
+      counters['success'] += 1
+      return {'filename': 'image_{}'.format(batch_index).encode('utf-8'),
+              'original_image': batch_index}
+
+    def _process_aggregated_results(result_lists):
+      metrics['filenames'] = list(result_lists['filename'])
+      return {'NumResults': float(len(result_lists['filename']))}
+
+    with tf.Graph().as_default():
+      tf.train.get_or_create_global_step()
+      tensor_dict = {
+          'filename': tf.constant(b'image'),
+          'original_image': tf.constant(0),
+      }
+      eval_util.run_checkpoint_once(
+          tensor_dict,
+          tf.no_op(),
+          summary_dir,
+          aggregated_result_processor=_process_aggregated_results,
+          batch_processor=_process_batch,
+          restore_fn=lambda sess: None,
+          num_batches=num_batches,
+          keys_to_exclude_from_results=('original_image',),
+          resume_skip_tensor=tensor_dict['filename'])
+    return evaluated_batches, metrics['filenames']
+
+  def test_completed_run_removes_checkpoint(self):
+    summary_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    with tf.test.mock.patch.object(eval_util, '_EVAL_CHECKPOINT_INTERVAL', 2):
+      evaluated_batches, filenames = self._run_checkpoint_once(summary_dir, 5)
+    self.assertEqual(evaluated_batches, [0, 1, 2, 3, 4])
+    self.assertEqual(len(filenames), 5)
+    self.assertFalse(tf.gfile.Exists(os.path.join(summary_dir, '_ckpt.pkl')))
+
+  def test_interrupted_run_is_resumed(self):
+    summary_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    with tf.test.mock.patch.object(eval_util, '_EVAL_CHECKPOINT_INTERVAL', 2):
+      with self.assertRaises(RuntimeError):
+        self._run_checkpoint_once(summary_dir, 5, fail_at_batch=3)
+      self.assertTrue(tf.gfile.Exists(os.path.join(summary_dir, '_ckpt.pkl')))
+
+      evaluated_batches, filenames = self._run_checkpoint_once(summary_dir, 5)
+    # batches 0 and 1 were checkpointed, batch 2 was not and is evaluated again
+    self.assertEqual(evaluated_batches, [2, 3, 4])
+    self.assertEqual(filenames, [
+        'image_{}'.format(i).encode('utf-8') for i in range(5)])
+    self.assertFalse(tf.gfile.Exists(os.path.join(summary_dir, '_ckpt.pkl')))
+
+
+if __name__ == '__main__':
+  tf.test.main()
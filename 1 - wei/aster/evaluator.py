@@ -15,6 +15,16 @@ EVAL_METRICS_FN_DICT = {
   'recognition_metrics': eval_util.evaluate_recognition_results,
 }
 
+# Evaluated tensors that the metrics functions do not read. They are still
+# fetched for visualization but not kept in the aggregated results.
+KEYS_TO_EXCLUDE_FROM_RESULTS = (
+  'original_image',
+  'original_image_shape',
+  'preprocessed_image_shape',
+  'control_points',
+  'rectified_images',
+)
+
 
 def _extract_prediction_tensors(model,
                                 create_input_dict_fn,
@@ -76,7 +86,8 @@ def _extract_prediction_tensors(model,
 
 def evaluate(create_input_dict_fn, create_model_fn, eval_config,
              checkpoint_dir, eval_dir,
-             repeat_evaluation=True):
+             repeat_evaluation=True,
+             deterministic_input=False):
   model = create_model_fn()
   data_preprocessing_steps = [
       preprocessor_builder.build(step)
@@ -90,12 +101,15 @@ def evaluate(create_input_dict_fn, create_model_fn, eval_config,
       evaluate_with_lexicon=eval_config.eval_with_lexicon)
 
   summary_writer = tf.summary.FileWriter(eval_dir)
+  result_visualizer = eval_util.ResultVisualizer()
+
+  # original images are only fetched for the batches that get visualized
+  tensor_dict_without_images = {k: v for (k, v) in tensor_dict.items()
+                                if k != 'original_image'}
 
   def _process_batch(tensor_dict, sess, batch_index, counters, update_op):
     if batch_index >= eval_config.num_visualizations:
-      if 'original_image' in tensor_dict:
-        tensor_dict = {k: v for (k, v) in tensor_dict.items()
-                       if k != 'original_image'}
+      tensor_dict = tensor_dict_without_images
     try:
       (result_dict, _) = sess.run([tensor_dict, update_op])
       counters['success'] += 1
@@ -105,7 +119,7 @@ def evaluate(create_input_dict_fn, create_model_fn, eval_config,
       return {}
     global_step = tf.train.global_step(sess, tf.train.get_global_step())
     if batch_index < eval_config.num_visualizations:
-      eval_util.visualize_recognition_results(
+      result_visualizer.visualize(
           result_dict,
           'Recognition_{}'.format(batch_index),
           global_step,
@@ -150,6 +164,11 @@ def evaluate(create_input_dict_fn, create_model_fn, eval_config,
           None if repeat_evaluation else 1),
       master=eval_config.eval_master,
       save_graph=eval_config.save_graph,
-      save_graph_dir=(eval_dir if eval_config.save_graph else ''))
+      save_graph_dir=(eval_dir if eval_config.save_graph else ''),
+      keys_to_exclude_from_results=KEYS_TO_EXCLUDE_FROM_RESULTS,
+      # resuming skips inputs by position, so it needs a fixed input order
+      resume_skip_tensor=(tensor_dict['filename'] if deterministic_input
+                          else None))
 
+  result_visualizer.close()
   summary_writer.close()
@@ -31,6 +31,29 @@ class RecognitionEvaluation(object):
     self.all_recognition_text.append(recognition_text.decode('utf-8'))
     self.all_groundtruth_text.append(groundtruth_text.decode('utf-8'))
 
+  def add_multiple_images_recognition_info(self, image_keys, recognition_texts, groundtruth_texts):
+    """
+    Args:
+      image_keys: iterable of Python strings
+      recognition_texts: iterable of numpy scalars of string type, aligned with
+        image_keys
+      groundtruth_texts: iterable of numpy scalars of string type, aligned with
+        image_keys
+    """
+    seen_keys = self.image_keys
+    new_recognition_text = []
+    new_groundtruth_text = []
+    for image_key, recognition_text, groundtruth_text in zip(
+        image_keys, recognition_texts, groundtruth_texts):
+      if image_key in seen_keys:
+        logging.warning('{} already evaluated'.format(image_key))
+        continue
+      seen_keys.add(image_key)
+      new_recognition_text.append(recognition_text.decode('utf-8'))
+      new_groundtruth_text.append(groundtruth_text.decode('utf-8'))
+    self.all_recognition_text.extend(new_recognition_text)
+    self.all_groundtruth_text.extend(new_groundtruth_text)
+
   def evaluate_all(self):
     num_samples = len(self.all_recognition_text)
 
@@ -0,0 +1,41 @@
+import tensorflow as tf
+
+from aster.utils import recognition_evaluation
+
+
+class RecognitionEvaluationTest(tf.test.TestCase):
+
+  def test_add_multiple_images_matches_single_image_adds(self):
+    image_keys = ['a', 'b', 'a', 'c']
+    recognition_texts = [b'Hello', b'world', b'again', b'foo']
+    groundtruth_texts = [b'hello', b'word', b'again', b'foo']
+
+    single = recognition_evaluation.RecognitionEvaluation()
+    for args in zip(image_keys, recognition_texts, groundtruth_texts):
+      single.add_single_image_recognition_info(*args)
+    multiple = recognition_evaluation.RecognitionEvaluation()
+    multiple.add_multiple_images_recognition_info(
+        image_keys, recognition_texts, groundtruth_texts)
+
+    self.assertEqual(multiple.image_keys, single.image_keys)
+    self.assertEqual(multiple.all_recognition_text,
+                     single.all_recognition_text)
+    self.assertEqual(multiple.all_groundtruth_text,
+                     single.all_groundtruth_text)
+    self.assertEqual(multiple.evaluate_all(), single.evaluate_all())
+
+  def test_add_multiple_images_skips_duplicate_keys(self):
+    evaluation = recognition_evaluation.RecognitionEvaluation()
+    evaluation.add_multiple_images_recognition_info(
+        ['a', 'b', 'a'], [b'x', b'y', b'z'], [b'x', b'y', b'z'])
+    self.assertEqual(evaluation.all_recognition_text, ['x', 'y'])
+
+    evaluation.add_multiple_images_recognition_info(
+        ['b', 'c'], [b'w', b'v'], [b'w', b'v'])
+    self.assertEqual(evaluation.image_keys, {'a', 'b', 'c'})
+    self.assertEqual(evaluation.all_recognition_text, ['x', 'y', 'v'])
+    self.assertEqual(evaluation.all_groundtruth_text, ['x', 'y', 'v'])
+
+
+if __name__ == '__main__':
+  tf.test.main()
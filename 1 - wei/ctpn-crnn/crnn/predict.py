@@ -7,75 +7,131 @@
 
 import numpy as np
 import sys, os
+import csv
 import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import tensorflow as tf
 
 sys.path.append(os.getcwd())
 
 # crnn packages
 import torch
-from torch.autograd import Variable
 import utils
-import dataset
 from PIL import Image, ImageFilter
 import models.crnn as crnn
 import alphabets
 
 str1 = alphabets.alphabet
+alphabet = str1
+nclass = len(alphabet) + 1
+# 字母表有几千个字符, converter只在导入时构建一次
+CONVERTER = utils.strLabelConverter(alphabet)
+# 输入图片大小 (w, h)
+IMAGE_SIZE = (192, 32)
 
 import argparse
 
 tf.app.flags.DEFINE_string('test_data_path', '/content/test_cptn_result', '')
 tf.app.flags.DEFINE_string('output_path', './', '')
+tf.app.flags.DEFINE_bool('quantize', False,
+                         'int8 dynamic quantization of LSTM/Linear layers, '
+                         'may change the recognized text')
 FLAGS = tf.app.flags.FLAGS
 
 
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png'}
+
+
+def _scan_images(root):
+    # scandir返回的DirEntry自带文件类型, 不需要再对每个文件stat
+    # 与os.walk一样不进入指向目录的符号链接, 避免链接成环时无限递归
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_images(entry.path)
+            elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                yield entry.path
+
+
 def get_images():
-    files = []
-    exts = ['jpg', 'png', 'jpeg', 'JPG']
-    for parent, dirnames, filenames in os.walk(FLAGS.test_data_path):
-        for filename in filenames:
-            for ext in exts:
-                if filename.endswith(ext):
-                    files.append(os.path.join(parent, filename))
-                    break
+    files = list(_scan_images(FLAGS.test_data_path))
     print('Find {} images'.format(len(files)))
     return files
 
 
 crnn_model_path = './expr/best_model.pth'
-alphabet = str1
-nclass = len(alphabet) + 1
 
+BATCH = 64
+# 同时在解码的图片数上限, 避免一次性把所有图片读进内存
+PREFETCH = 4 * BATCH
+NUM_WORKERS = 8
 
-# crnn文本信息识别
-def crnn_recognition(cropped_image, model):
-    converter = utils.strLabelConverter(alphabet)
 
-    image = cropped_image.convert('L')
+def _load_and_transform(im_fn):
+    # PIL的解码和resize在C代码中会释放GIL, 可以在线程池中并行
+    image = Image.open(im_fn).convert('L')
+    image = image.resize(IMAGE_SIZE, Image.BILINEAR)
+    return im_fn, np.asarray(image, dtype=np.uint8)
 
+
+def normalize_batch(images):
+    # 与dataset.resizeNormalize相同: (x / 255 - 0.5) / 0.5, 对整个batch一次完成
+    batch = np.stack(images).astype(np.float32)
+    batch /= 127.5
+    batch -= 1.0
+    return torch.from_numpy(batch).unsqueeze(1)
+
+
+def iter_images(im_fn_list, executor):
+    # 保持最多PREFETCH张图片在线程池中解码, 按完成顺序返回(im_fn, image)
+    im_fn_iter = iter(im_fn_list)
+    pending = set(executor.submit(_load_and_transform, im_fn)
+                  for im_fn in itertools.islice(im_fn_iter, PREFETCH))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+            im_fn = next(im_fn_iter, None)
+            if im_fn is not None:
+                pending.add(executor.submit(_load_and_transform, im_fn))
+
+
+# crnn文本信息识别
+def crnn_recognition(images, model):
     ##
     # w = int(image.size[0] / (280 * 1.0 / 160))
-    transformer = dataset.resizeNormalize((192, 32))
-    image = transformer(image)
+    n = len(images)
+    image = normalize_batch(images)
+    if n < BATCH:
+        # trace后的模型输入shape固定, 最后一个不满的batch补零
+        padding = image.new_zeros((BATCH - n,) + tuple(image.shape[1:]))
+        image = torch.cat([image, padding])
+    image = image.contiguous(memory_format=torch.channels_last)
     # if torch.cuda.is_available():
     #     image = image.cuda()
-    image = image.view(1, *image.size())
-    image = Variable(image)
 
-    model.eval()
-    preds = model(image)
+    with torch.no_grad():
+        preds = model(image)[:, :n]
 
     _, preds = preds.max(2)
+    length = preds.size(0)
     preds = preds.transpose(1, 0).contiguous().view(-1)
 
-    preds_size = Variable(torch.IntTensor([preds.size(0)]))
-    sim_pred = converter.decode(preds.data, preds_size.data, raw=False)
-    # print('results: {0}'.format(sim_pred))
-    return sim_pred
+    preds_size = torch.IntTensor([length] * n)
+    sim_preds = CONVERTER.decode(preds, preds_size, raw=False)
+    # 单张图片时decode返回的是str而不是list
+    if n == 1:
+        sim_preds = [sim_preds]
+    # print('results: {0}'.format(sim_preds))
+    return sim_preds
 
 
 if __name__ == '__main__':
+    # 小模型用默认的线程数(逻辑核数)会互相争抢, 只用物理核数的线程
+    torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+    torch.set_num_interop_threads(1)
+
     # crnn network
     model = crnn.CRNN(32, 1, nclass, 256)
     # if torch.cuda.is_available():
@@ -83,23 +139,43 @@ if __name__ == '__main__':
     print('loading pretrained model from {0}'.format(crnn_model_path))
     # 导入已经训练好的crnn模型
     model.load_state_dict(torch.load(crnn_model_path, map_location='cpu'))
+    model.eval()
+    # 卷积使用NHWC(channels_last)布局, 避免MKL-DNN每次调用时的格式转换
+    model = model.to(memory_format=torch.channels_last)
+    if FLAGS.quantize:
+        # CPU推理: LSTM和Linear的权重动态量化为int8
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+    # 输入shape固定, trace一次得到静态图, 减少逐个op的Python调度开销
+    with torch.no_grad():
+        example = torch.zeros(BATCH, 1, IMAGE_SIZE[1], IMAGE_SIZE[0])
+        example = example.contiguous(memory_format=torch.channels_last)
+        model = torch.jit.trace(model, example)
 
     started = time.time()
     ## read an image
     im_fn_list = get_images()
     with open(os.path.join(FLAGS.output_path, "crnn_train_result_0606.csv"),
-              "a") as f:
-        title ='name,label'+ "\r\n"
-        f.writelines(title)
-        for i, im_fn in enumerate(im_fn_list):
-            if i%1000==0:
-                print('.................'+str(i)+'................')
-            image = Image.open(im_fn)
-            result = crnn_recognition(image, model)
-            line = os.path.basename(im_fn)
-            # print(line,result)
-            line += ',' + result + "\r\n"
-            f.writelines(line)
+              "w", buffering=1 << 20, newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'label'])
+
+        def write_batch(batch_fns, images):
+            results = crnn_recognition(images, model)
+            writer.writerows(zip(map(os.path.basename, batch_fns), results))
+
+        batch_fns, images = [], []
+        with ThreadPoolExecutor(max_workers=NUM_WORKERS) as executor:
+            for i, (im_fn, image) in enumerate(iter_images(im_fn_list, executor)):
+                if i % 1000 == 0:
+                    print('.................'+str(i)+'................')
+                batch_fns.append(im_fn)
+                images.append(image)
+                if len(images) == BATCH:
+                    write_batch(batch_fns, images)
+                    batch_fns, images = [], []
+        if images:
+            write_batch(batch_fns, images)
 
     finished = time.time()
     print('elapsed time: {0}'.format(finished - started))